@@ -1,39 +1,57 @@
 import pygame
 import dearpygui.dearpygui as dpg
 import numpy as np
-from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
-from qiskit_aer import AerSimulator
-from qiskit.quantum_info import Statevector
-import math
-from dataclasses import dataclass
+from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister, qasm2, transpile
+import functools
+import hashlib
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
 from typing import List, Tuple, Dict, Optional
+import os
 import sys
 import subprocess
 import tempfile
+import time
 
 
-@dataclass
+@dataclass(slots=True, eq=False)
 class Wire:
-    points: List[Tuple[int, int]]
-    connected_gates: List[str] = None
-    sensors: List[Tuple[int, int]] = None
-
-    def __post_init__(self):
-        self.connected_gates = []
-        self.sensors = []
+    xs: np.ndarray
+    ys: np.ndarray
+    connected_gates: List[str] = field(default_factory=list)
+    sensors: List[Tuple[int, int]] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class Gate:
     type: str
     pos: Tuple[int, int]
-    connected_wires: List[Wire] = None
-
-    def __post_init__(self):
-        self.connected_wires = []
+    connected_wires: List[Wire] = field(default_factory=list)
 
 
 class QuantumCircuitDesigner:
+    BOX_TABLE = str.maketrans(
+        {
+            "─": "-",
+            "│": "|",
+            "┌": "+",
+            "┐": "+",
+            "└": "+",
+            "┘": "+",
+            "├": "+",
+            "┤": "+",
+            "╭": "(",
+            "╰": ")",
+            "═": "=",
+            "║": "|",
+            "╬": "|",
+            "░": "/",
+            "╩": "|",
+            "╥": "-",
+            "■": "%",
+        }
+    )
+
     def __init__(self):
         pygame.init()
 
@@ -53,6 +71,10 @@ class QuantumCircuitDesigner:
 
         self.screen = pygame.display.set_mode((800, 600), pygame.RESIZABLE)
         pygame.display.set_caption("Quantum Circuit Designer")
+        self._grid_surf = None
+        self._grid_size_cache = None
+        self._wire_layer = None
+        self._wire_vertex_cache = []
 
         self.offset_x = 0
         self.offset_y = 0
@@ -63,20 +85,83 @@ class QuantumCircuitDesigner:
         self.gates = []
         self.sensors = []
         self.circuit = None
-        self.simulator = AerSimulator()
+        self._gate_dispatch = {
+            "H": QuantumCircuit.h,
+            "X": QuantumCircuit.x,
+            "Y": QuantumCircuit.y,
+            "Z": QuantumCircuit.z,
+        }
+        self.use_gpu = False
+        self.gpu_min_qubits = 8
+        self.shots = 1000
+        self._sim_cache = OrderedDict()
+        self._sim_cache_size = 32
+        self._transpile_cache = OrderedDict()
+        self._pending_job = None
+        self._pending_keys = None
+        self._pending_counts = None
 
         self.drawing_wire = False
-        self.current_wire_points = []
+        self.current_wire_xs = np.empty(1024, dtype=np.int32)
+        self.current_wire_ys = np.empty(1024, dtype=np.int32)
+        self.current_wire_len = 0
         self.dragging_gate = None
         self.selected_tool = None
         self.sensor_data = {}
         self.sensor_table = None
+        self.debug_external_view = False
+        self.dpg_frame_interval = 4
+        self._last_input_ts = time.monotonic()
+
+        self._seg_p1 = np.empty((0, 2), dtype=np.float32)
+        self._seg_p2 = np.empty((0, 2), dtype=np.float32)
+        self._seg_wire_idx = np.empty(0, dtype=np.intp)
+        self._seg_start = np.empty(0)
+        self._wire_length = np.empty(0)
+        self._segments_dirty = True
+        self._seg_by_cell = {}
+        self._wire_cell_size = self.grid_size * 8
+        self._gate_by_cell = {}
+        self._sensor_by_cell = {}
+        self._uf_parent = []
+        self._endpoint_by_cell = {}
 
         self.font = pygame.font.SysFont("Arial", 16)
+        self.glyph_size = 20
+        self.build_glyphs()
 
         dpg.create_context()
         self.setup_dpg()
 
+    @functools.cached_property
+    def simulator(self):
+        from qiskit_aer import AerSimulator
+
+        simulator = AerSimulator()
+        simulator.set_options(
+            max_parallel_experiments=os.cpu_count(),
+            max_parallel_threads=os.cpu_count(),
+        )
+        return simulator
+
+    @functools.cached_property
+    def gpu_simulator(self):
+        from qiskit_aer import AerSimulator, AerError
+
+        try:
+            if "GPU" not in self.simulator.available_devices():
+                return None
+            simulator = AerSimulator(method="statevector", device="GPU")
+        except (ImportError, AerError) as e:
+            print(f"GPU simulator unavailable: {str(e)}")
+            return None
+
+        simulator.set_options(
+            max_parallel_experiments=os.cpu_count(),
+            max_parallel_threads=os.cpu_count(),
+        )
+        return simulator
+
     def setup_dpg(self):
         dpg.create_viewport(title="Circuit Tools", width=300, height=600)
 
@@ -131,6 +216,27 @@ class QuantumCircuitDesigner:
                                 "Run quantum simulation and collect measurements"
                             )
 
+                        gpu_box = dpg.add_checkbox(
+                            label="Use GPU",
+                            default_value=self.use_gpu,
+                            callback=lambda s, a: self.toggle_gpu(s, a),
+                        )
+                        with dpg.tooltip(parent=gpu_box):
+                            dpg.add_text(
+                                f"Simulate on the GPU for circuits with "
+                                f"{self.gpu_min_qubits}+ wires"
+                            )
+
+                        external_box = dpg.add_checkbox(
+                            label="Open in Terminal",
+                            default_value=self.debug_external_view,
+                            callback=lambda s, a: self.toggle_external_view(a),
+                        )
+                        with dpg.tooltip(parent=external_box):
+                            dpg.add_text(
+                                "Also show the circuit diagram in a terminal window"
+                            )
+
                         dpg.add_separator()
                         with dpg.collapsing_header(
                             label="Circuit Info", default_open=True
@@ -174,8 +280,8 @@ class QuantumCircuitDesigner:
             return
 
         try:
-            qr = QuantumRegister(max(len(self.wires), 1))
-            cr = ClassicalRegister(max(len(self.wires), 1))
+            qr = QuantumRegister(max(len(self.wires), 1), "q")
+            cr = ClassicalRegister(max(len(self.wires), 1), "c")
             self.circuit = QuantumCircuit(qr, cr)
             print(f"Circuit initialized with {len(self.wires)} wires")
 
@@ -188,83 +294,169 @@ class QuantumCircuitDesigner:
         return (x, y)
 
     def handle_mouse_down(self, pos):
+        self._last_input_ts = time.monotonic()
         grid_pos = self.snap_to_grid(pos)
 
         if self.selected_tool == "DELETE":
-            for gate in self.gates[:]:
+            for gate in self.nearby(self._gate_by_cell, grid_pos):
                 if self.point_near_pos(gate.pos, grid_pos):
-                    self.gates.remove(gate)
+                    self.remove_gate(gate)
 
-            for sensor in self.sensors[:]:
+            for sensor in self.nearby(self._sensor_by_cell, grid_pos):
                 if self.point_near_pos(sensor, grid_pos):
-                    self.sensors.remove(sensor)
-
-            for wire in self.wires[:]:
-                for p1, p2 in zip(wire.points, wire.points[1:]):
-                    if self.point_on_line_segment(grid_pos, p1, p2):
-                        self.wires.remove(wire)
-                        break
+                    self.remove_sensor(sensor)
+
+            self.rebuild_segments()
+            candidates = self.segments_near(grid_pos)
+            hits = candidates[self.segments_at(grid_pos, candidates)]
+            hit_wires = set(self._seg_wire_idx[hits].tolist())
+            if hit_wires:
+                self.wires = [
+                    wire for idx, wire in enumerate(self.wires) if idx not in hit_wires
+                ]
+                self._segments_dirty = True
+                self._wire_layer = None
+                self.rebuild_wire_connections()
         elif self.selected_tool == "WIRE":
             self.drawing_wire = True
-            self.current_wire_points = [grid_pos]
+            self.current_wire_xs[0], self.current_wire_ys[0] = grid_pos
+            self.current_wire_len = 1
         elif self.selected_tool in self.GATE_COLORS:
-            self.gates.append(Gate(self.selected_tool, grid_pos))
+            self.add_gate(Gate(self.selected_tool, grid_pos))
         elif self.selected_tool == "SENSOR":
-            self.sensors.append(grid_pos)
+            self.add_sensor(grid_pos)
+
+    def cell_of(self, pos, cell_size=None):
+        cell_size = cell_size or self.grid_size
+        return (int(pos[0] // cell_size), int(pos[1] // cell_size))
+
+    def nearby(self, index, pos):
+        cx, cy = self.cell_of(pos)
+        found = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                found.extend(index.get((cx + dx, cy + dy), ()))
+        return found
+
+    def add_gate(self, gate):
+        self.gates.append(gate)
+        self._gate_by_cell.setdefault(self.cell_of(gate.pos), []).append(gate)
+
+    def remove_gate(self, gate):
+        self.gates.remove(gate)
+        self._gate_by_cell[self.cell_of(gate.pos)].remove(gate)
+
+    def add_sensor(self, pos):
+        self.sensors.append(pos)
+        self._sensor_by_cell.setdefault(self.cell_of(pos), []).append(pos)
+
+    def remove_sensor(self, pos):
+        self.sensors.remove(pos)
+        self._sensor_by_cell[self.cell_of(pos)].remove(pos)
 
     def handle_mouse_up(self, pos):
+        self._last_input_ts = time.monotonic()
         if self.drawing_wire:
             self.drawing_wire = False
-            if len(self.current_wire_points) > 1:
-                self.wires.append(Wire(self.current_wire_points.copy()))
-            self.current_wire_points = []
+            n = self.current_wire_len
+            if n > 1:
+                self.wires.append(
+                    Wire(
+                        self.current_wire_xs[:n].copy(), self.current_wire_ys[:n].copy()
+                    )
+                )
+                self._segments_dirty = True
+                self._wire_layer = None
+                self.register_wire_connections(len(self.wires) - 1)
+            self.current_wire_len = 0
 
     def handle_mouse_motion(self, pos):
+        self._last_input_ts = time.monotonic()
         if self.drawing_wire:
             grid_pos = self.snap_to_grid(pos)
-            if grid_pos != self.current_wire_points[-1]:
-                self.current_wire_points.append(grid_pos)
-
-    def draw_wire(self, points, color=None):
+            n = self.current_wire_len
+            if (
+                grid_pos[0] != self.current_wire_xs[n - 1]
+                or grid_pos[1] != self.current_wire_ys[n - 1]
+            ):
+                if n == len(self.current_wire_xs):
+                    self.current_wire_xs = np.resize(self.current_wire_xs, 2 * n)
+                    self.current_wire_ys = np.resize(self.current_wire_ys, 2 * n)
+                self.current_wire_xs[n], self.current_wire_ys[n] = grid_pos
+                self.current_wire_len = n + 1
+
+    def draw_wire(self, xs, ys, color=None):
         if not color:
             color = self.WIRE_COLOR
-        if len(points) > 1:
-            pygame.draw.lines(self.screen, color, False, points, 2)
+        if len(xs) > 1:
+            pygame.draw.lines(self.screen, color, False, np.column_stack((xs, ys)), 2)
 
-    def draw_gate(self, gate: Gate):
-        color = self.GATE_COLORS[gate.type]
-        size = 20
-        rect = pygame.Rect(gate.pos[0] - size // 2, gate.pos[1] - size // 2, size, size)
-        pygame.draw.rect(self.screen, color, rect, border_radius=3)
+    def build_glyphs(self):
+        self._glyphs = {
+            letter: self.font.render(letter, True, (0, 0, 0)).convert_alpha()
+            for letter in "HXYZCS"
+        }
 
         label_map = {"H": "H", "X": "X", "Y": "Y", "Z": "Z", "CNOT": "C", "SENSOR": "S"}
+        self._gate_surf = {
+            gate_type: self.compose_glyph(color, label_map[gate_type])
+            for gate_type, color in self.GATE_COLORS.items()
+        }
+        self._sensor_surf = self.compose_glyph(self.SENSOR_COLOR, "S")
 
-        text = self.font.render(label_map[gate.type], True, (0, 0, 0))
-        text_rect = text.get_rect(center=gate.pos)
-        self.screen.blit(text, text_rect)
+    def compose_glyph(self, color, letter):
+        size = self.glyph_size
+        surf = pygame.Surface((size, size), pygame.SRCALPHA)
+        pygame.draw.rect(surf, color, surf.get_rect(), border_radius=3)
 
-    def draw_sensor(self, pos):
-        size = 20
-        rect = pygame.Rect(pos[0] - size // 2, pos[1] - size // 2, size, size)
-        pygame.draw.rect(self.screen, self.SENSOR_COLOR, rect, border_radius=3)
+        text = self._glyphs[letter]
+        surf.blit(text, text.get_rect(center=(size // 2, size // 2)))
+        return surf.convert_alpha()
 
-        text = self.font.render("S", True, (0, 0, 0))
-        text_rect = text.get_rect(center=pos)
-        self.screen.blit(text, text_rect)
+    def draw_gate(self, gate: Gate):
+        half = self.glyph_size // 2
+        self.screen.blit(
+            self._gate_surf[gate.type], (gate.pos[0] - half, gate.pos[1] - half)
+        )
 
-    def draw(self):
-        self.screen.fill(self.BACKGROUND)
+    def draw_sensor(self, pos):
+        half = self.glyph_size // 2
+        self.screen.blit(self._sensor_surf, (pos[0] - half, pos[1] - half))
 
+    def build_grid_surface(self):
         w, h = self.screen.get_size()
+        self._grid_surf = pygame.Surface((w, h)).convert()
+        self._grid_surf.fill(self.BACKGROUND)
+
         for x in range(0, w, self.grid_size):
-            pygame.draw.line(self.screen, self.GRID_COLOR, (x, 0), (x, h))
+            pygame.draw.line(self._grid_surf, self.GRID_COLOR, (x, 0), (x, h))
         for y in range(0, h, self.grid_size):
-            pygame.draw.line(self.screen, self.GRID_COLOR, (0, y), (w, y))
+            pygame.draw.line(self._grid_surf, self.GRID_COLOR, (0, y), (w, y))
+
+        self._grid_size_cache = (w, h)
+
+    def build_wire_layer(self):
+        self._wire_vertex_cache = [
+            np.column_stack((wire.xs, wire.ys)) for wire in self.wires
+        ]
+
+        self._wire_layer = self._grid_surf.copy()
+        for vertices in self._wire_vertex_cache:
+            pygame.draw.lines(self._wire_layer, self.WIRE_COLOR, False, vertices, 2)
+
+    def draw(self):
+        if self._grid_surf is None or self._grid_size_cache != self.screen.get_size():
+            self.build_grid_surface()
+            self._wire_layer = None
+        if self._wire_layer is None:
+            self.build_wire_layer()
+        self.screen.blit(self._wire_layer, (0, 0))
 
-        for wire in self.wires:
-            self.draw_wire(wire.points)
         if self.drawing_wire:
-            self.draw_wire(self.current_wire_points, (255, 255, 0))
+            n = self.current_wire_len
+            self.draw_wire(
+                self.current_wire_xs[:n], self.current_wire_ys[:n], (255, 255, 0)
+            )
 
         for gate in self.gates:
             self.draw_gate(gate)
@@ -277,141 +469,198 @@ class QuantumCircuitDesigner:
             print("No wires to simulate")
             return
 
+        if self._pending_job is not None:
+            print("Simulation already running")
+            return
+
         try:
             self.initialize_circuit()
 
-            wire_connections = self.find_wire_connections()
-            print(f"Wire connections: {wire_connections}")
+            groups = defaultdict(list)
+            for wire_idx in range(len(self.wires)):
+                groups[self.find_wire_root(wire_idx)].append(wire_idx)
 
-            processed_wires = set()
-            for wire_idx, wire in enumerate(self.wires):
-                if wire_idx in processed_wires:
-                    continue
+            gates_by_wire = self.assign_gates_to_wires()
 
-                connected_group = self.get_connected_wires(wire_idx, wire_connections)
+            for connected_group in groups.values():
                 print(f"Processing connected wire group: {connected_group}")
 
                 for connected_wire_idx in connected_group:
                     self.circuit.reset(connected_wire_idx)
-                    wire = self.wires[connected_wire_idx]
-
-                    wire_gates = []
-                    for gate in self.gates:
-                        for p1, p2 in zip(wire.points, wire.points[1:]):
-                            if self.point_on_line_segment(gate.pos, p1, p2):
-                                wire_gates.append(
-                                    (gate, self.get_position_along_wire(gate.pos, wire))
-                                )
 
+                    wire_gates = gates_by_wire.get(connected_wire_idx, [])
                     wire_gates.sort(key=lambda x: x[1])
 
                     for gate, _ in wire_gates:
                         self.add_gate_to_circuit(gate.type, connected_wire_idx)
 
-                    processed_wires.add(connected_wire_idx)
-
+            self.rebuild_segments()
             measurements_added = False
             for sensor_idx, sensor_pos in enumerate(self.sensors):
-                for wire_idx, wire in enumerate(self.wires):
-                    for p1, p2 in zip(wire.points, wire.points[1:]):
-                        if self.point_on_line_segment(sensor_pos, p1, p2):
-                            self.circuit.measure(wire_idx, wire_idx)
-                            measurements_added = True
-                            break
+                hit_wires = np.unique(self._seg_wire_idx[self.segments_at(sensor_pos)])
+                for wire_idx in hit_wires.tolist():
+                    self.circuit.measure(wire_idx, wire_idx)
+                    measurements_added = True
 
             if not measurements_added:
                 self.circuit.measure_all()
 
+            circuit_text = str(self.circuit)
             print("Final circuit:")
-            print(self.circuit)
-
-            with tempfile.NamedTemporaryFile(mode="w", delete=False) as f:
-                f.write(str(self.circuit))
-                temp_path = f.name
-
-            if sys.platform == "darwin":
-                subprocess.Popen(
-                    [
-                        "osascript",
-                        "-e",
-                        f'tell app "Terminal" to do script "less {temp_path}"',
-                    ]
-                )
-            elif sys.platform == "linux":
-                subprocess.Popen(["gnome-terminal", "--", "less", temp_path])
-            elif sys.platform == "win32":
-                subprocess.Popen(
-                    ["start", "cmd", "/k", f"type {temp_path}"], shell=True
-                )
-
-            circuit_str = str(self.circuit).split("\n")
-            simplified_circuit = []
-            for line in circuit_str:
-                simplified_line = (
-                    line.replace("─", "-")
-                    .replace("│", "|")
-                    .replace("┌", "+")
-                    .replace("┐", "+")
-                    .replace("└", "+")
-                    .replace("┘", "+")
-                    .replace("├", "+")
-                    .replace("┤", "+")
-                    .replace("╭", "(")
-                    .replace("╰", ")")
-                    .replace("═", "=")
-                    .replace("║", "|")
-                    .replace("╬", "|")
-                    .replace("░", "/")
-                    .replace("╩", "|")
-                    .replace("╥", "-")
-                    .replace("■", "%")
-                )
-                simplified_circuit.append(simplified_line)
+            print(circuit_text)
 
-            dpg.set_value(self.circuit_info, "\n".join(simplified_circuit))
+            if self.debug_external_view:
+                self.open_external_view(circuit_text)
 
-            job = self.simulator.run(self.circuit, shots=1000)
-            counts = job.result().get_counts()
-            print(f"Raw counts: {counts}")
+            dpg.set_value(self.circuit_info, circuit_text.translate(self.BOX_TABLE))
 
-            self.sensor_data = self.process_measurement_results(counts)
-            print(f"Processed data: {self.sensor_data}")
-            self.update_sensor_table()
+            self.submit_simulation([self.circuit], self.shots)
 
         except Exception as e:
-            error_msg = f"Simulation error: {str(e)}"
-            print(error_msg)
-            dpg.set_value(self.circuit_info, error_msg)
-            import traceback
+            self.show_simulation_error(e)
+
+    def open_external_view(self, circuit_text):
+        with tempfile.NamedTemporaryFile(mode="w", delete=False) as f:
+            f.write(circuit_text)
+            temp_path = f.name
+
+        if sys.platform == "darwin":
+            subprocess.Popen(
+                [
+                    "osascript",
+                    "-e",
+                    f'tell app "Terminal" to do script "less {temp_path}"',
+                ]
+            )
+        elif sys.platform == "linux":
+            subprocess.Popen(["gnome-terminal", "--", "less", temp_path])
+        elif sys.platform == "win32":
+            subprocess.Popen(["start", "cmd", "/k", f"type {temp_path}"], shell=True)
+
+    def submit_simulation(self, circuits, shots):
+        digests = [self.circuit_digest(circuit) for circuit in circuits]
+        keys = [(digest, shots) for digest in digests]
+        counts_list = [self._sim_cache.get(key) for key in keys]
+
+        for key, counts in zip(keys, counts_list):
+            if counts is not None:
+                self._sim_cache.move_to_end(key)
+
+        missing = [i for i, counts in enumerate(counts_list) if counts is None]
+        if not missing:
+            print("Using cached simulation results")
+            self.finalize_simulation(counts_list)
+            return
 
-            traceback.print_exc()
+        simulator = self.select_simulator([circuits[i] for i in missing])
+        batch = [self.transpiled(circuits[i], digests[i], simulator) for i in missing]
+        self._pending_job = simulator.run(batch, shots=shots)
+        self._pending_keys = keys
+        self._pending_counts = counts_list
+
+    def circuit_digest(self, circuit):
+        return hashlib.blake2b(qasm2.dumps(circuit).encode()).digest()
+
+    def transpiled(self, circuit, digest, simulator):
+        key = (digest, simulator.options.device)
+
+        tqc = self._transpile_cache.get(key)
+        if tqc is not None:
+            self._transpile_cache.move_to_end(key)
+            return tqc
+
+        tqc = transpile(circuit, simulator, optimization_level=1)
+        self._transpile_cache[key] = tqc
+        if len(self._transpile_cache) > self._sim_cache_size:
+            self._transpile_cache.popitem(last=False)
+        return tqc
+
+    def select_simulator(self, circuits):
+        if (
+            self.use_gpu
+            and self.gpu_simulator is not None
+            and max(circuit.num_qubits for circuit in circuits) >= self.gpu_min_qubits
+        ):
+            return self.gpu_simulator
+        return self.simulator
+
+    def poll_simulation(self):
+        if self._pending_job is None or not self._pending_job.in_final_state():
+            return
 
-    def find_wire_connections(self):
-        connections = {}
+        job = self._pending_job
+        keys, counts_list = self._pending_keys, self._pending_counts
+        self._pending_job = None
+        self._pending_keys = None
+        self._pending_counts = None
 
-        for i, wire1 in enumerate(self.wires):
-            connections[i] = set()
-            for j, wire2 in enumerate(self.wires):
-                if i != j:
-                    for p1 in [wire1.points[0], wire1.points[-1]]:
-                        for p2 in [wire2.points[0], wire2.points[-1]]:
-                            if self.point_near_pos(p1, p2, threshold=10):
-                                connections[i].add(j)
+        try:
+            result = job.result()
+            missing = [i for i, counts in enumerate(counts_list) if counts is None]
+            for experiment, i in enumerate(missing):
+                counts_list[i] = result.get_counts(experiment)
+        except Exception as e:
+            self.show_simulation_error(e)
+            return
+
+        for key, counts in zip(keys, counts_list):
+            self._sim_cache[key] = counts
+            self._sim_cache.move_to_end(key)
+        while len(self._sim_cache) > self._sim_cache_size:
+            self._sim_cache.popitem(last=False)
 
-        return connections
+        self.finalize_simulation(counts_list)
 
-    def get_connected_wires(self, start_wire, connections):
-        connected = set([start_wire])
-        stack = [start_wire]
+    def finalize_simulation(self, counts_list):
+        counts = counts_list[0]
+        print(f"Raw counts: {counts}")
 
-        while stack:
-            current = stack.pop()
-            for neighbor in connections[current]:
-                if neighbor not in connected:
-                    connected.add(neighbor)
-                    stack.append(neighbor)
+        self.sensor_data = self.process_measurement_results(counts)
+        print(f"Processed data: {self.sensor_data}")
+        self.update_sensor_table()
 
-        return connected
+    def show_simulation_error(self, e):
+        error_msg = f"Simulation error: {str(e)}"
+        print(error_msg)
+        dpg.set_value(self.circuit_info, error_msg)
+        import traceback
+
+        traceback.print_exc()
+
+    def find_wire_root(self, idx):
+        parent = self._uf_parent
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    def union_wires(self, a, b):
+        root_a = self.find_wire_root(a)
+        root_b = self.find_wire_root(b)
+        if root_a != root_b:
+            self._uf_parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    def register_wire_connections(self, idx):
+        wire = self.wires[idx]
+        self._uf_parent.append(idx)
+
+        endpoints = [
+            (int(wire.xs[0]), int(wire.ys[0])),
+            (int(wire.xs[-1]), int(wire.ys[-1])),
+        ]
+        for p1 in endpoints:
+            for other_idx, p2 in self.nearby(self._endpoint_by_cell, p1):
+                if self.point_near_pos(p1, p2, threshold=10):
+                    self.union_wires(idx, other_idx)
+
+        for p in endpoints:
+            self._endpoint_by_cell.setdefault(self.cell_of(p), []).append((idx, p))
+
+    def rebuild_wire_connections(self):
+        self._uf_parent = []
+        self._endpoint_by_cell = {}
+        for idx in range(len(self.wires)):
+            self.register_wire_connections(idx)
 
     def process_measurement_results(self, counts):
         processed_data = {}
@@ -422,56 +671,22 @@ class QuantumCircuitDesigner:
         if not counts or total_shots == 0:
             return {}
 
-        for bitstring, count in counts.items():
-            probability = count / total_shots
-            bits = "".join(bitstring.split())
+        keys = np.array(["".join(bitstring.split()) for bitstring in counts])
+        probs = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        probs /= total_shots
+
+        chars = keys.view("U1").reshape(len(keys), -1)
+        zeros_per_sensor = (chars == "0").T @ probs
+        ones_per_sensor = (chars == "1").T @ probs
 
-            for sensor_idx, bit in enumerate(bits):
-                sensor_key = f"Sensor {sensor_idx}"
-                if sensor_key not in processed_data:
-                    processed_data[sensor_key] = {"0": 0, "1": 0}
-                if bit in ["0", "1"]:
-                    processed_data[sensor_key][bit] += probability
+        for sensor_idx, (p0, p1) in enumerate(
+            zip(zeros_per_sensor.tolist(), ones_per_sensor.tolist())
+        ):
+            processed_data[f"Sensor {sensor_idx}"] = {"0": p0, "1": p1}
 
         print(f"Processed data: {processed_data}")
         return processed_data
 
-    def point_on_line_segment(self, point, line_start, line_end):
-        d = self.point_to_line_distance(point, line_start, line_end)
-        if d > self.grid_size / 2:
-            return False
-
-        x, y = point
-        x1, y1 = line_start
-        x2, y2 = line_end
-
-        return min(x1, x2) <= x <= max(x1, x2) and min(y1, y2) <= y <= max(y1, y2)
-
-    def get_position_along_wire(self, point, wire):
-        total_length = 0
-        current_length = 0
-        target_segment = None
-        segment_start = 0
-
-        for p1, p2 in zip(wire.points, wire.points[1:]):
-            segment_length = math.sqrt((p2[0] - p1[0]) ** 2 + (p2[1] - p1[1]) ** 2)
-            total_length += segment_length
-
-            if self.point_on_line_segment(point, p1, p2):
-                target_segment = (p1, p2)
-                segment_start = current_length
-            current_length += segment_length
-
-        if target_segment:
-            p1, p2 = target_segment
-            segment_length = math.sqrt((p2[0] - p1[0]) ** 2 + (p2[1] - p1[1]) ** 2)
-            point_distance = math.sqrt(
-                (point[0] - p1[0]) ** 2 + (point[1] - p1[1]) ** 2
-            )
-            return (segment_start + point_distance) / total_length
-
-        return 0
-
     def update_sensor_table(self):
         if not self.sensor_data:
             dpg.set_value(self.sensor_text, "No measurements available")
@@ -503,6 +718,7 @@ class QuantumCircuitDesigner:
     def run(self):
         clock = pygame.time.Clock()
         running = True
+        frame = 0
 
         while running:
             for event in pygame.event.get():
@@ -520,11 +736,21 @@ class QuantumCircuitDesigner:
                     self.screen = pygame.display.set_mode(
                         (event.w, event.h), pygame.RESIZABLE
                     )
+                    self._grid_surf = None
+
+            self.poll_simulation()
 
             self.draw()
             pygame.display.flip()
-            dpg.render_dearpygui_frame()
-            clock.tick(60)
+
+            active = (
+                time.monotonic() - self._last_input_ts < 0.5
+                or self._pending_job is not None
+            )
+            if not active or frame % self.dpg_frame_interval == 0:
+                dpg.render_dearpygui_frame()
+            frame += 1
+            clock.tick(60 if active else 10)
 
         dpg.destroy_context()
         pygame.quit()
@@ -534,64 +760,167 @@ class QuantumCircuitDesigner:
         print(f"Selected tool: {tool}")
 
         self.drawing_wire = False
-        self.current_wire_points = []
+        self.current_wire_len = 0
         self.dragging_gate = None
 
-    def find_nearest_wire_index(self, point) -> Optional[int]:
-        min_dist = float("inf")
-        nearest_idx = None
+    def toggle_external_view(self, enabled):
+        self.debug_external_view = enabled
+        print(f"External circuit view: {'on' if enabled else 'off'}")
 
-        for idx, wire in enumerate(self.wires):
-            for p1, p2 in zip(wire.points, wire.points[1:]):
-                dist = self.point_to_line_distance(point, p1, p2)
-                if dist < min_dist:
-                    min_dist = dist
-                    nearest_idx = idx
+    def toggle_gpu(self, checkbox, enabled):
+        if enabled and self.gpu_simulator is None:
+            print("GPU simulator unavailable")
+            dpg.set_value(checkbox, False)
+            enabled = False
 
-        return nearest_idx if min_dist < self.grid_size else None
+        self.use_gpu = enabled
+        print(f"GPU simulation: {'on' if enabled else 'off'}")
 
-    def add_gate_to_circuit(self, gate_type: str, wire_idx: int):
-        if not self.circuit or wire_idx is None:
+    def find_nearest_wire_index(self, point) -> Optional[int]:
+        dist = self.segment_distances(point)
+        if not len(dist):
+            return None
+
+        nearest = int(np.argmin(dist))
+        if dist[nearest] >= self.grid_size:
+            return None
+        return int(self._seg_wire_idx[nearest])
+
+    def rebuild_segments(self):
+        if not self._segments_dirty:
             return
 
-        try:
-            if gate_type == "H":
-                self.circuit.h(wire_idx)
-                print(f"Added Hadamard gate to wire {wire_idx}")
-            elif gate_type == "X":
-                self.circuit.x(wire_idx)
-            elif gate_type == "Y":
-                self.circuit.y(wire_idx)
-            elif gate_type == "Z":
-                self.circuit.z(wire_idx)
-            elif gate_type == "CNOT" and wire_idx < len(self.wires) - 1:
-                self.circuit.cx(wire_idx, wire_idx + 1)
-        except Exception as e:
-            print(f"Error adding gate: {str(e)}")
+        if self.wires:
+            xs1 = np.concatenate([wire.xs[:-1] for wire in self.wires])
+            ys1 = np.concatenate([wire.ys[:-1] for wire in self.wires])
+            xs2 = np.concatenate([wire.xs[1:] for wire in self.wires])
+            ys2 = np.concatenate([wire.ys[1:] for wire in self.wires])
+            counts = [len(wire.xs) - 1 for wire in self.wires]
+        else:
+            xs1 = ys1 = xs2 = ys2 = np.empty(0, dtype=np.int32)
+            counts = []
+
+        self._seg_p1 = np.column_stack((xs1, ys1)).astype(np.float32)
+        self._seg_p2 = np.column_stack((xs2, ys2)).astype(np.float32)
+        self._seg_wire_idx = np.repeat(np.arange(len(counts)), counts)
+
+        seg_length = np.linalg.norm(self._seg_p2 - self._seg_p1, axis=1)
+        self._wire_length = np.bincount(
+            self._seg_wire_idx, weights=seg_length, minlength=len(counts)
+        )
+        wire_offset = np.cumsum(self._wire_length) - self._wire_length
+        self._seg_start = (
+            np.cumsum(seg_length) - seg_length - wire_offset[self._seg_wire_idx]
+        )
+
+        pad = self.grid_size / 2
+        size = self._wire_cell_size
+        lo = np.floor((np.minimum(self._seg_p1, self._seg_p2) - pad) / size)
+        hi = np.floor((np.maximum(self._seg_p1, self._seg_p2) + pad) / size)
+
+        self._seg_by_cell = {}
+        for seg_idx, (x0, y0, x1, y1) in enumerate(
+            np.hstack((lo, hi)).astype(int).tolist()
+        ):
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    self._seg_by_cell.setdefault((cx, cy), []).append(seg_idx)
+
+        self._segments_dirty = False
+
+    def segments_near(self, point):
+        self.rebuild_segments()
+        cell = self.cell_of(point, self._wire_cell_size)
+        return np.array(self._seg_by_cell.get(cell, ()), dtype=np.intp)
+
+    def segment_distances(self, point, idx=None):
+        self.rebuild_segments()
+
+        p = np.asarray(point, dtype=np.float32)
+        p1 = self._seg_p1 if idx is None else self._seg_p1[idx]
+        p2 = self._seg_p2 if idx is None else self._seg_p2[idx]
+        d = p2 - p1
+        length_sq = (d * d).sum(-1)
+
+        t = np.divide(
+            ((p - p1) * d).sum(-1),
+            length_sq,
+            out=np.zeros_like(length_sq),
+            where=length_sq > 0,
+        )
+        t = np.clip(t, 0, 1)
 
-    def point_to_line_distance(self, point, line_start, line_end):
-        x0, y0 = point
-        x1, y1 = line_start
-        x2, y2 = line_end
+        proj = p1 + t[:, None] * d
+        return np.linalg.norm(p - proj, axis=1)
 
-        if (x1, y1) == (x2, y2):
-            return math.sqrt((x0 - x1) ** 2 + (y0 - y1) ** 2)
+    def segments_at(self, point, idx=None):
+        dist = self.segment_distances(point, idx)
 
-        numerator = (x0 - x1) * (x2 - x1) + (y0 - y1) * (y2 - y1)
-        denominator = math.sqrt((y2 - y1) ** 2 + (x2 - x1) ** 2)
+        x, y = point
+        p1 = self._seg_p1 if idx is None else self._seg_p1[idx]
+        p2 = self._seg_p2 if idx is None else self._seg_p2[idx]
+        lo = np.minimum(p1, p2)
+        hi = np.maximum(p1, p2)
+
+        return (
+            (dist <= self.grid_size / 2)
+            & (lo[:, 0] <= x)
+            & (x <= hi[:, 0])
+            & (lo[:, 1] <= y)
+            & (y <= hi[:, 1])
+        )
 
-        if denominator == 0:
-            return float("inf")
+    def assign_gates_to_wires(self):
+        self.rebuild_segments()
+        if not self.gates or not len(self._seg_wire_idx):
+            return {}
 
-        t = max(
-            0,
-            min(1, numerator / (denominator**2)),
+        points = np.array([gate.pos for gate in self.gates], dtype=np.float32)
+        p1 = self._seg_p1
+        d = self._seg_p2 - p1
+        length_sq = (d * d).sum(-1)
+
+        rel = points[:, None, :] - p1[None, :, :]
+        t = np.divide(
+            (rel * d).sum(-1),
+            length_sq,
+            out=np.zeros(rel.shape[:2], dtype=np.float32),
+            where=length_sq > 0,
         )
+        t = np.clip(t, 0, 1)
+        dist = np.linalg.norm(rel - t[..., None] * d, axis=-1)
 
-        proj_x = x1 + t * (x2 - x1)
-        proj_y = y1 + t * (y2 - y1)
+        lo = np.minimum(p1, self._seg_p2)
+        hi = np.maximum(p1, self._seg_p2)
+        inside = ((lo <= points[:, None, :]) & (points[:, None, :] <= hi)).all(-1)
+        dist[~inside] = np.inf
 
-        return math.sqrt((x0 - proj_x) ** 2 + (y0 - proj_y) ** 2)
+        seg = np.argmin(dist, axis=1)
+        gate_idx = np.arange(len(self.gates))
+        on_wire = dist[gate_idx, seg] <= self.grid_size / 2
+
+        wire_idx = self._seg_wire_idx[seg]
+        along = np.linalg.norm(points - p1[seg], axis=1) + self._seg_start[seg]
+        total = self._wire_length[wire_idx]
+        position = np.divide(along, total, out=np.zeros_like(along), where=total > 0)
+
+        gates_by_wire = defaultdict(list)
+        for i in gate_idx[on_wire].tolist():
+            gates_by_wire[int(wire_idx[i])].append((self.gates[i], float(position[i])))
+        return gates_by_wire
+
+    def add_gate_to_circuit(self, gate_type: str, wire_idx: int):
+        if not self.circuit or wire_idx is None:
+            return
+
+        try:
+            fn = self._gate_dispatch.get(gate_type)
+            if fn:
+                fn(self.circuit, wire_idx)
+            elif gate_type == "CNOT" and wire_idx < len(self.wires) - 1:
+                self.circuit.cx(wire_idx, wire_idx + 1)
+        except Exception as e:
+            print(f"Error adding gate: {str(e)}")
 
     def clear_board(self):
         self.wires = []
@@ -599,6 +928,15 @@ class QuantumCircuitDesigner:
         self.sensors = []
         self.circuit = None
         self.sensor_data = {}
+        self._segments_dirty = True
+        self._wire_layer = None
+        self._gate_by_cell = {}
+        self._sensor_by_cell = {}
+        self._uf_parent = []
+        self._endpoint_by_cell = {}
+        self._pending_job = None
+        self._pending_keys = None
+        self._pending_counts = None
         self.update_sensor_table()
 
     def point_near_pos(self, pos1, pos2, threshold=20):